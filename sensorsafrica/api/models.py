@@ -39,6 +39,16 @@ class SensorDataStat(TimeStampedModel):
 
     timestamp = models.DateTimeField()
 
+    class Meta:
+        # The stats endpoint always filters by value_type and a timestamp
+        # range, optionally narrowed to cities
+        indexes = [
+            models.Index(
+                fields=["city_slug", "value_type", "timestamp"],
+                name="city_value_ts_idx",
+            )
+        ]
+
     def __str__(self):
         return "%s %s %s avg=%s min=%s max=%s" % (
             self.timestamp,
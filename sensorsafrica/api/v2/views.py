@@ -1,4 +1,5 @@
 import datetime
+import functools
 import django_filters
 import pytz
 import json
@@ -7,13 +8,30 @@ from dateutil.relativedelta import relativedelta
 
 from django.contrib.auth.models import User
 from django.conf import settings
+from django.core.cache import cache
 from django.utils import timezone
 from django.db import connection
-from django.db.models import ExpressionWrapper, F, FloatField, Max, Min, Sum, Avg, Q
-from django.db.models.functions import Cast, TruncHour, TruncDay, TruncMonth
+from django.http import StreamingHttpResponse
+from django.utils.cache import patch_response_headers
+from django.db.models import (
+    BigIntegerField,
+    Exists,
+    ExpressionWrapper,
+    F,
+    FloatField,
+    Func,
+    Max,
+    Min,
+    OuterRef,
+    Sum,
+    Avg,
+    Q,
+)
+from django.db.models.functions import Cast, TruncMonth
 from django.utils.decorators import method_decorator
 from django.utils.text import slugify
 from django.views.decorators.cache import cache_page
+from django.views.decorators.vary import vary_on_headers
 
 from rest_framework import mixins, pagination, viewsets
 from rest_framework.authentication import SessionAuthentication, TokenAuthentication
@@ -21,6 +39,7 @@ from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from rest_framework.decorators import api_view, authentication_classes
+from rest_framework.utils.encoders import JSONEncoder
 
 from feinstaub.sensors.views import SensorFilter, StandardResultsSetPagination
 
@@ -49,6 +68,33 @@ from .filters import CustomSensorFilter
 
 value_types = {"air": ["P1", "P2", "humidity", "temperature"]}
 
+# Uppercased once at import time instead of per request
+VALUE_TYPES_UPPER = {
+    sensor_type: frozenset(value_type.upper() for value_type in type_list)
+    for sensor_type, type_list in value_types.items()
+}
+
+# The universe of city names is tiny and repeats across nodes; cache the
+# slugs instead of re-running slugify's regexes for every node
+_slugify = functools.lru_cache(maxsize=256)(slugify)
+
+
+class EpochBucket(Func):
+    """Group timestamps into fixed-width buckets of bucket_size seconds.
+
+    Grouping on a bigint bucket instead of DATE_TRUNC gives the Postgres
+    planner accurate group-count estimates, so it can pick HashAggregate
+    over GroupAggregate on large ranges. With TIME_ZONE = "UTC" the hour
+    and day buckets line up exactly with DATE_TRUNC boundaries.
+    """
+
+    template = "(EXTRACT(EPOCH FROM %(expressions)s)::bigint / %(bucket_size)s)"
+
+    def __init__(self, expression, bucket_size):
+        super().__init__(
+            expression, bucket_size=bucket_size, output_field=BigIntegerField()
+        )
+
 
 def beginning_of_today():
     return timezone.now().replace(hour=0, minute=0, second=0, microsecond=0)
@@ -83,25 +129,16 @@ class CustomPagination(pagination.PageNumberPagination):
         # We will need to have a list of the value_types e.g. { 'P1': [{}, {}] }
         from_date = self.request.query_params.get("from", None)
         interval = self.request.query_params.get("interval", None)
+        is_list = bool(from_date or interval)
 
         results = {}
         for data_stat in data_stats:
             city_slug = data_stat["city_slug"]
             value_type = data_stat["value_type"]
 
-            if city_slug not in results:
-                results[city_slug] = {
-                    "city_slug": city_slug,
-                    value_type: [] if from_date or interval else {},
-                }
-
-            if value_type not in results[city_slug]:
-                results[city_slug][value_type] = [] if from_date or interval else {}
-
-            values = results[city_slug][value_type]
-            include_result = getattr(
-                values, "append" if from_date or interval else "update"
-            )
+            entry = results.setdefault(city_slug, {"city_slug": city_slug})
+            values = entry.setdefault(value_type, [] if is_list else {})
+            include_result = values.append if is_list else values.update
             include_result(
                 {
                     "average": data_stat["calculated_average"],
@@ -116,12 +153,16 @@ class CustomPagination(pagination.PageNumberPagination):
             {
                 "next": self.get_next_link(),
                 "previous": self.get_previous_link(),
-                "count": len(results.keys()),
+                "count": len(results),
                 "results": list(results.values()),
             }
         )
 
 
+# Cities change rarely; cache the rendered list for a day, varying on the
+# negotiation headers so json and browsable responses don't collide
+@method_decorator(cache_page(86400), name="dispatch")
+@method_decorator(vary_on_headers("Accept", "Accept-Encoding"), name="dispatch")
 class CitiesView(mixins.ListModelMixin, viewsets.GenericViewSet):
     queryset = City.objects.all()
     serializer_class = CitySerializer
@@ -139,79 +180,150 @@ class NodesView(viewsets.ViewSet):
 
         return [permission() for permission in permission_classes]
 
-    def list(self, request):
-        nodes = []
-        # Loop through the last active nodes
-        for last_active in LastActiveNodes.objects.iterator():
-            # Get the current node
-            node = Node.objects.filter(
-                Q(id=last_active.node.id), ~Q(sensors=None)
-            ).get()
-
-            # The last acive date
+    @staticmethod
+    def _stats_by_node(last_actives):
+        """Aggregate data stats for all the last active nodes in one query.
+
+        Each node gets a 5 minute window ending at its
+        last_data_received_at; the windows are OR-ed together so a single
+        grouped query replaces one aggregation query per node. Results
+        are keyed by (node_id, location_id).
+        """
+        windows = Q()
+        for last_active in last_actives:
             last_data_received_at = last_active.last_data_received_at
+            if not last_data_received_at:
+                continue
+            windows |= Q(
+                sensordata__sensor__node=last_active.node_id,
+                sensordata__location=last_active.location_id,
+                sensordata__timestamp__gte=last_data_received_at
+                - datetime.timedelta(minutes=5),
+                sensordata__timestamp__lte=last_data_received_at,
+            )
 
-            # last_data_received_at
-            stats = []
-            moved_to = None
-            # Get data stats from 5mins before last_data_received_at
-            if last_data_received_at:
-                last_5_mins = last_data_received_at - datetime.timedelta(minutes=5)
-                stats = (
-                    SensorDataValue.objects.filter(
-                        Q(sensordata__sensor__node=last_active.node.id),
-                        Q(sensordata__location=last_active.location.id),
-                        Q(sensordata__timestamp__gte=last_5_mins),
-                        Q(sensordata__timestamp__lte=last_data_received_at),
-                        # Ignore timestamp values
-                        ~Q(value_type="timestamp"),
-                        # Match only valid float text
-                        Q(value__regex=r"^\-?\d+(\.?\d+)?$"),
-                    )
-                    .order_by()
-                    .values("value_type")
-                    .annotate(
-                        sensor_id=F("sensordata__sensor__id"),
-                        start_datetime=Min("sensordata__timestamp"),
-                        end_datetime=Max("sensordata__timestamp"),
-                        average=Avg(Cast("value", FloatField())),
-                        minimum=Min(Cast("value", FloatField())),
-                        maximum=Max(Cast("value", FloatField())),
-                    )
-                )
+        stats_by_node = {}
+        if not windows:
+            return stats_by_node
+
+        stats = (
+            SensorDataValue.objects.filter(
+                windows,
+                # Ignore timestamp values
+                ~Q(value_type="timestamp"),
+                # Match only valid float text
+                Q(value__regex=r"^\-?\d+(\.?\d+)?$"),
+            )
+            .order_by()
+            .values(
+                "value_type", "sensordata__sensor__node", "sensordata__location"
+            )
+            .annotate(
+                sensor_id=F("sensordata__sensor__id"),
+                start_datetime=Min("sensordata__timestamp"),
+                end_datetime=Max("sensordata__timestamp"),
+                average=Avg(Cast("value", FloatField())),
+                minimum=Min(Cast("value", FloatField())),
+                maximum=Max(Cast("value", FloatField())),
+            )
+        )
+        for stat in stats:
+            key = (
+                stat.pop("sensordata__sensor__node"),
+                stat.pop("sensordata__location"),
+            )
+            stats_by_node.setdefault(key, []).append(stat)
 
-            # If the last_active node location is not same as current node location
-            # then the node has moved locations since it was last active
-            if last_active.location.id != node.location.id:
-                moved_to = {
-                    "name": node.location.location,
-                    "longitude": node.location.longitude,
-                    "latitude": node.location.latitude,
-                    "city": {
-                        "name": node.location.city,
-                        "slug": slugify(node.location.city),
-                    },
-                }
+        return stats_by_node
 
-            nodes.append(
-                {
-                    "node_moved": moved_to is not None,
-                    "moved_to": moved_to,
-                    "node": {"uid": last_active.node.uid, "id": last_active.node.id, "owner": last_active.node.owner.id},
-                    "location": {
-                        "name": last_active.location.location,
-                        "longitude": last_active.location.longitude,
-                        "latitude": last_active.location.latitude,
+    def list(self, request):
+        # Loop through the last active nodes, pulling the node, its owner and
+        # both locations in the same query instead of issuing fresh queries
+        # per node. Nodes without sensors are filtered out with an EXISTS
+        # subquery, and only the handful of fields the response needs are
+        # fetched and hydrated.
+        last_actives = list(
+            LastActiveNodes.objects.annotate(
+                has_sensors=Exists(Sensor.objects.filter(node=OuterRef("node_id")))
+            )
+            .filter(has_sensors=True)
+            .select_related("node", "node__location", "location")
+            .only(
+                "last_data_received_at",
+                "node__uid",
+                "node__owner",
+                "node__location__location",
+                "node__location__longitude",
+                "node__location__latitude",
+                "node__location__city",
+                "location__location",
+                "location__longitude",
+                "location__latitude",
+                "location__city",
+            )
+        )
+
+        # Get data stats from 5mins before last_data_received_at, for all
+        # nodes at once
+        stats_by_node = self._stats_by_node(last_actives)
+
+        def stream():
+            # Serialize and send one node at a time instead of holding the
+            # full payload plus its encoded bytes in memory
+            yield "["
+            separator = ""
+            for last_active in last_actives:
+                # The current node
+                node = last_active.node
+
+                # The last acive date
+                last_data_received_at = last_active.last_data_received_at
+
+                stats = stats_by_node.get(
+                    (last_active.node_id, last_active.location_id), []
+                )
+                moved_to = None
+
+                # If the last_active node location is not same as current node location
+                # then the node has moved locations since it was last active
+                if last_active.location.id != node.location.id:
+                    moved_to = {
+                        "name": node.location.location,
+                        "longitude": node.location.longitude,
+                        "latitude": node.location.latitude,
                         "city": {
-                            "name": last_active.location.city,
-                            "slug": slugify(last_active.location.city),
+                            "name": node.location.city,
+                            "slug": _slugify(node.location.city),
+                        },
+                    }
+
+                yield separator + json.dumps(
+                    {
+                        "node_moved": moved_to is not None,
+                        "moved_to": moved_to,
+                        "node": {
+                            "uid": node.uid,
+                            "id": node.id,
+                            "owner": node.owner_id,
+                        },
+                        "location": {
+                            "name": last_active.location.location,
+                            "longitude": last_active.location.longitude,
+                            "latitude": last_active.location.latitude,
+                            "city": {
+                                "name": last_active.location.city,
+                                "slug": _slugify(last_active.location.city),
+                            },
                         },
+                        "last_data_received_at": last_data_received_at,
+                        "stats": stats,
                     },
-                    "last_data_received_at": last_data_received_at,
-                    "stats": stats,
-                }
-            )
-        return Response(nodes)
+                    cls=JSONEncoder,
+                )
+                separator = ","
+            yield "]"
+
+        return StreamingHttpResponse(stream(), content_type="application/json")
 
     def create(self, request):
         serializer = NodeSerializer(data=request.data)
@@ -263,9 +375,58 @@ class SensorDataStatsView(mixins.ListModelMixin, viewsets.GenericViewSet):
     serializer_class = SensorDataStatSerializer
     pagination_class = CustomPagination
 
-    @method_decorator(cache_page(3600))
+    cache_timeout = 3600
+
+    def _cache_key(self, request, sensor_type):
+        # cache_page keys on the raw URL, so reordered or differently
+        # cased query params miss the cache for identical results. Build
+        # a canonical key from the normalized params instead.
+        params = request.GET
+        cities = ",".join(
+            sorted(city.lower() for city in params.get("city", "").split(",") if city)
+        )
+        requested_value_types = ",".join(
+            sorted(
+                value_type.upper()
+                for value_type in params.get("value_type", "").split(",")
+                if value_type
+            )
+        )
+        return "sensordatastats:%s:%s:%s:%s:%s:%s:%s:%s:%s" % (
+            sensor_type,
+            params.get("from", ""),
+            params.get("to", ""),
+            params.get("interval", ""),
+            cities,
+            requested_value_types,
+            params.get("page", ""),
+            params.get("page_size", ""),
+            request.META.get("HTTP_ACCEPT", ""),
+        )
+
     def dispatch(self, request, *args, **kwargs):
-        return super().dispatch(request, *args, **kwargs)
+        # Only GET and HEAD responses are cacheable; an OPTIONS response
+        # must not be stored under (or served from) the same key as a GET
+        if request.method not in ("GET", "HEAD"):
+            return super().dispatch(request, *args, **kwargs)
+
+        key = self._cache_key(request, kwargs.get("sensor_type", ""))
+        response = cache.get(key)
+        if response is not None:
+            return response
+
+        response = super().dispatch(request, *args, **kwargs)
+        if response.status_code == 200:
+            timeout = self.cache_timeout
+            # Advertise the cache lifetime downstream, as cache_page did
+            patch_response_headers(response, timeout)
+            if hasattr(response, "render") and callable(response.render):
+                response.add_post_render_callback(
+                    lambda rendered: cache.set(key, rendered, timeout)
+                )
+            else:
+                cache.set(key, response, timeout)
+        return response
 
     def get_queryset(self):
         sensor_type = self.kwargs["sensor_type"]
@@ -286,8 +447,13 @@ class SensorDataStatsView(mixins.ListModelMixin, viewsets.GenericViewSet):
 
         filter_value_types = value_types[sensor_type]
         if value_type_to_filter:
-            filter_value_types = set(value_type_to_filter.upper().split(",")) & set(
-                [x.upper() for x in value_types[sensor_type]]
+            # Sorting keeps the SQL parameter stable however the client
+            # orders the comma-separated list
+            filter_value_types = tuple(
+                sorted(
+                    set(value_type_to_filter.upper().split(","))
+                    & VALUE_TYPES_UPPER[sensor_type]
+                )
             )
 
         if not from_date and not to_date:
@@ -309,15 +475,19 @@ class SensorDataStatsView(mixins.ListModelMixin, viewsets.GenericViewSet):
             timestamp__lte=to_date,
         )
 
+        # Months are not fixed width, so they still need TruncMonth
         if interval == "month":
             truncate = TruncMonth("timestamp")
         elif interval == "day":
-            truncate = TruncDay("timestamp")
+            truncate = EpochBucket("timestamp", 86400)
         else:
-            truncate = TruncHour("timestamp")
+            truncate = EpochBucket("timestamp", 3600)
 
         if city_slugs:
-            queryset = queryset.filter(city_slug__in=city_slugs.split(","))
+            # Stored slugs come from slugify and are always lowercase;
+            # lowercasing the param keeps the filter in step with the
+            # lowercased cache key in _cache_key
+            queryset = queryset.filter(city_slug__in=city_slugs.lower().split(","))
 
         return (
             queryset.values("value_type", "city_slug")
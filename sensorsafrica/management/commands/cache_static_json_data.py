@@ -56,7 +56,7 @@ class Command(BaseCommand):
         }
         cursor = connection.cursor()
         cursor.execute('''
-            SELECT sd.sensor_id, sdv.value_type, AVG(CAST(sdv."value" AS FLOAT)) as "value", COUNT("value"), sd.location_id
+            SELECT sd.sensor_id, sdv.value_type, AVG(CAST(sdv."value" AS FLOAT)) as "value", COUNT("value") as "samples", sd.location_id
                 FROM sensors_sensordata sd
                     INNER JOIN sensors_sensordatavalue sdv
                         ON  sdv.sensordata_id = sd.id
@@ -66,28 +66,28 @@ class Command(BaseCommand):
                 GROUP BY sd.sensor_id, sdv.value_type, sd.location_id
         ''', [intervals[options['interval']]])
 
+        # Resolve the column names once and build dict rows instead of
+        # indexing every tuple by position
+        columns = [column[0] for column in cursor.description]
+
         data = {}
-        while True:
-            row = cursor.fetchone()
-            if row is None:
-                break
-
-            if row[0] in data:
-                data[row[0]]['sensordatavalues'].append(dict({
-                    'samples': row[3],
-                    'value': row[2],
-                    'value_type': row[1]
-                }))
+        for row in cursor:
+            row = dict(zip(columns, row))
+            sensor_id = row['sensor_id']
+            value = {
+                'samples': row['samples'],
+                'value': row['value'],
+                'value_type': row['value_type']
+            }
+
+            if sensor_id in data:
+                data[sensor_id]['sensordatavalues'].append(value)
             else:
-                data[row[0]] = dict({
-                    'location': SensorLocationSerializer(SensorLocation.objects.get(pk=row[4])).data,
-                    'sensor': SensorSerializer(Sensor.objects.get(pk=row[0])).data,
-                    'sensordatavalues': [{
-                        'samples': row[3],
-                        'value': row[2],
-                        'value_type': row[1]
-                    }]
-                })
+                data[sensor_id] = {
+                    'location': SensorLocationSerializer(SensorLocation.objects.get(pk=row['location_id'])).data,
+                    'sensor': SensorSerializer(Sensor.objects.get(pk=sensor_id)).data,
+                    'sensordatavalues': [value]
+                }
 
         for path in paths[options['interval']]:
             with open(
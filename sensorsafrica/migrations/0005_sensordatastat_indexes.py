@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sensorsafrica', '0004_auto_20190509_1145'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sensordatastat',
+            index=models.Index(fields=['city_slug', 'value_type', 'timestamp'], name='city_value_ts_idx'),
+        ),
+    ]
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('sensors', '0022_auto_20210211_2023'),
+    ]
+
+    operations = [
+        # Both the node stats and the statistics rollup filter values with
+        # value ~ '^-?\d+(\.?\d+)?$' and then cast to float. A partial
+        # expression index on the cast lets Postgres answer the filter and
+        # the cast from the index instead of running the regex per row.
+        migrations.RunSQL(
+            sql=r"""
+                CREATE INDEX CONCURRENTLY IF NOT EXISTS sensors_sdv_numeric_idx
+                ON sensors_sensordatavalue ((value::double precision), value_type, sensordata_id)
+                WHERE value ~ '^\-?\d+(\.?\d+)?$';
+            """,
+            reverse_sql=r"DROP INDEX CONCURRENTLY IF EXISTS sensors_sdv_numeric_idx;",
+        ),
+    ]
@@ -0,0 +1,22 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('sensors', '0023_sensordatavalue_numeric_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='sensordata',
+            index=models.Index(fields=['timestamp', 'location'], name='sd_ts_loc_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='sensordatavalue',
+            index=models.Index(fields=['sensordata', 'value_type'], name='sdv_sd_vt_idx'),
+        ),
+    ]
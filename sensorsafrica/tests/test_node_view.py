@@ -1,3 +1,5 @@
+import json
+
 import pytest
 import datetime
 from django.utils import timezone
@@ -35,3 +37,48 @@ class TestNodesView:
         assert node.uid == data_fixture["uid"]
         assert node.location == location
         assert node.owner == logged_in_user
+
+    def test_list_nodes(
+        self, client, logged_in_user, nodes, locations, sensors, last_active
+    ):
+        # Move the Dar es Salaam node after its last active entry was
+        # cached so the response flags the move
+        nodes[0].location = locations[1]
+        nodes[0].save()
+
+        response = client.get("/v2/nodes/")
+        assert response.status_code == 200
+        assert response["Content-Type"] == "application/json"
+
+        data = json.loads(b"".join(response.streaming_content).decode("utf-8"))
+        results = {result["node"]["uid"]: result for result in data}
+
+        # Nodes 0, 3 and 4 sent P1/P2 data recently; nodes 1 and 2 did not
+        assert len(results) == 3
+
+        moved = results["0"]
+        assert moved["node_moved"]
+        assert moved["moved_to"]["city"]["name"] == "Bagamoyo"
+        assert moved["moved_to"]["city"]["slug"] == "bagamoyo"
+        # The last active location, not the one the node moved to
+        assert moved["location"]["city"]["name"] == "Dar es Salaam"
+        assert moved["location"]["city"]["slug"] == "dar-es-salaam"
+
+        nairobi = results["3"]
+        assert not nairobi["node_moved"]
+        assert nairobi["moved_to"] is None
+        assert nairobi["node"]["owner"] == logged_in_user.id
+        assert nairobi["location"]["city"]["slug"] == "nairobi"
+        assert nairobi["last_data_received_at"] == last_active[1].isoformat().replace(
+            "+00:00", "Z"
+        )
+
+        # Stats are aggregated per value_type within the node's 5 minute
+        # window: 100 P2 values of 0 plus one P1 value of 4
+        stats = {stat["value_type"]: stat for stat in nairobi["stats"]}
+        assert stats["P1"]["average"] == 4.0
+        assert stats["P1"]["minimum"] == 4.0
+        assert stats["P1"]["maximum"] == 4.0
+        assert stats["P2"]["average"] == 0.0
+        assert stats["P2"]["minimum"] == 0.0
+        assert stats["P2"]["maximum"] == 0.0